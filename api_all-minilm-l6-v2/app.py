@@ -1,11 +1,25 @@
+import asyncio
+import base64
 import logging
+import os
 import time
 from typing import List, Union, Optional
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, HTTPException
+# Intra-op threads per worker process. With several uvicorn workers (WEB_CONCURRENCY), keep
+# TORCH_THREADS * WEB_CONCURRENCY <= physical cores to avoid oversubscription.
+# OpenMP/MKL read their env vars on import, so these are set before torch is imported.
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", os.cpu_count()))
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_THREADS))
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 from sentence_transformers import SentenceTransformer
+import msgspec
+import numpy as np
 import torch
 import tiktoken
 
@@ -13,10 +27,32 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Pre-exported INT8 (AVX512-VNNI) ONNX variant shipped with the model repo, cached in the image at build time
+ONNX_FILE_NAME = "onnx/model_qint8_avx512_vnni.onnx"
+# CPU inference backend: "onnx" (INT8 ONNX Runtime, default) or "torch" (FP32, reference-exact vectors). Ignored on GPU.
+BACKEND = os.getenv("BACKEND", "onnx")
+# encode() sorts texts by length before splitting into mini-batches of this size (and restores
+# input order afterwards), so each mini-batch is padded only to its own longest text
+ENCODE_BATCH_SIZE = 32
+MODEL_ID = "all-MiniLM-L6-v2"
+# encoding_format -> dtype of the base64 payload. "base64" is float32 as in the OpenAI spec (what the
+# OpenAI SDKs decode); "base64_float16" is an opt-in half-size variant
+BASE64_DTYPES = {"base64": "float32", "base64_float16": "float16"}
+# Optional Model2Vec static-embedding model (MODEL_BACKEND=m2v), selected per request via the `model` field
+M2V_MODEL_NAME = "minishlab/potion-base-8M"
+M2V_MODEL_ID = "potion-base-8M"
+# Dynamic micro-batching: concurrent requests arriving within MAX_BATCH_WAIT_MS of each other are
+# coalesced (up to MAX_BATCH_TEXTS texts) into a single encode call
+MAX_BATCH_WAIT_MS = float(os.getenv("MAX_BATCH_WAIT_MS", "3"))
+MAX_BATCH_TEXTS = int(os.getenv("MAX_BATCH_TEXTS", "512"))
 model = None
+static_model = None
 tokenizer = None
+batchers = {}
 
-class OpenAIEmbeddingRequest(BaseModel):
+# Request bodies are msgspec Structs decoded straight from the raw body (see msgspec_body), which is
+# several times faster than Starlette's json parse + Pydantic validation for thousands of input strings
+class OpenAIEmbeddingRequest(msgspec.Struct):
     model: str
     input: Union[str, List[str]]
     encoding_format: Optional[str] = "float"
@@ -38,7 +74,7 @@ class OpenAIEmbeddingResponse(BaseModel):
     model: str
     usage: OpenAIUsage
 
-class OllamaEmbedRequest(BaseModel):
+class OllamaEmbedRequest(msgspec.Struct):
     model: str
     input: Union[str, List[str]]
     truncate: Optional[bool] = True
@@ -59,24 +95,189 @@ class ModelsResponse(BaseModel):
     object: str = "list"
     data: List[ModelInfo]
 
-def estimate_tokens(text: str) -> int:
+class StaticEmbeddingModel:
+    """Wraps a Model2Vec StaticModel to expose the SentenceTransformer.encode() subset used by the endpoints."""
+
+    def __init__(self, static):
+        self._static = static
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        # Averaged token vectors, no transformer layers
+        embeddings = self._static.encode(texts, show_progress_bar=False)
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+        return embeddings
+
+class MicroBatcher:
+    """
+    Coalesces concurrent encode requests into one model.encode call.
+
+    A background task takes the first pending request, waits up to max_wait_ms for more (until
+    max_batch_texts texts are pending), encodes all texts at once on the batcher's own worker thread
+    so the event loop is not blocked, then scatters the result rows back to each request's future.
+
+    Each batcher has a single dedicated worker: its model (and GPU context) is never driven from two
+    threads at once, and one model's encodes never queue behind another's.
+    """
+
+    def __init__(self, encoder, name: str, max_wait_ms: float, max_batch_texts: int):
+        self._encoder = encoder
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"encode-{name}")
+        self._max_wait = max_wait_ms / 1000
+        self._max_batch_texts = max_batch_texts
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._dimension = 0  # Set by warmup()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, texts: List[str]) -> np.ndarray:
+        """Encode texts as part of the next coalesced batch. Returns normalized embeddings, one row per text."""
+        if not texts:
+            # Nothing to encode (and encode() can't shape an empty result): empty (0, dimension) array
+            return np.empty((0, self._dimension), dtype=np.float32)
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def warmup(self):
+        """Run one encode on the worker thread so the first request doesn't pay for thread start-up
+        and lazy kernel/session initialization. Also records the embedding dimension."""
+        embeddings = await asyncio.get_running_loop().run_in_executor(self._executor, self._encode, ["warmup"])
+        self._dimension = embeddings.shape[1]
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        embeddings = self._encoder.encode(texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+        if len(embeddings.shape) == 1:
+            embeddings = embeddings.reshape(len(texts), -1)
+        return embeddings
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            pending = [await self._queue.get()]
+            pending_texts = len(pending[0][0])
+            deadline = loop.time() + self._max_wait
+
+            while pending_texts < self._max_batch_texts:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                pending_texts += len(item[0])
+
+            all_texts = [text for texts, _ in pending for text in texts]
+
+            try:
+                embeddings = await loop.run_in_executor(self._executor, self._encode, all_texts)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for texts, future in pending:
+                # Skip requests whose client has gone away (future cancelled)
+                if not future.done():
+                    future.set_result(embeddings[offset:offset + len(texts)])
+                offset += len(texts)
+
+def resolve_model(requested: str):
+    """Return (model_id, batcher) for the request's `model` field. Anything but the static model uses the transformer."""
+    if M2V_MODEL_ID in batchers and requested in (M2V_MODEL_ID, M2V_MODEL_NAME):
+        return M2V_MODEL_ID, batchers[M2V_MODEL_ID]
+    return MODEL_ID, batchers[MODEL_ID]
+
+def msgspec_body(struct_type: type):
+    """FastAPI dependency that decodes and validates the JSON request body into `struct_type` in one pass."""
+    decoder = msgspec.json.Decoder(struct_type)
+
+    async def parse(request: Request):
+        try:
+            return decoder.decode(await request.body())
+        except msgspec.DecodeError as e:
+            # ValidationError is a DecodeError subclass; keep FastAPI's 422 for invalid bodies
+            raise HTTPException(status_code=422, detail=str(e))
+
+    return parse
+
+def count_words(texts: List[str]) -> int:
+    # Word-count fallback: str.count runs in C and, unlike split(), builds no per-word strings
+    return sum(text.count(" ") + 1 for text in texts)
+
+def estimate_total_tokens(texts: List[str]) -> int:
+    # One batched call into tiktoken's Rust core instead of one FFI round-trip per text
+    if tokenizer is None:
+        return count_words(texts)
     try:
-        if tokenizer:
-            return len(tokenizer.encode(text))
-        else:
-            return len(text.split())
-    except:
-        return len(text.split())
+        return sum(map(len, tokenizer.encode_ordinary_batch(texts)))
+    except Exception:
+        return count_words(texts)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global model, tokenizer
+    global model, static_model, tokenizer
     logger.info("Loading sentence-transformers model...")
 
     try:
+        torch.set_num_threads(TORCH_THREADS)
+        torch.set_num_interop_threads(1)
+        logger.info(f"Using {TORCH_THREADS} intra-op threads")
+
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        model = SentenceTransformer(MODEL_NAME, device=device)
-        logger.info(f"Model loaded successfully on {device}")
+        if device == "cpu" and BACKEND not in ("onnx", "torch"):
+            raise ValueError(f"Unsupported BACKEND '{BACKEND}', must be one of: onnx, torch")
+
+        if device == "cpu" and BACKEND == "onnx":
+            # ONNX Runtime with INT8 weights: fused, VNNI-accelerated MatMul kernels on CPU
+            import onnxruntime as ort
+
+            session_options = ort.SessionOptions()
+            session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session_options.intra_op_num_threads = TORCH_THREADS
+            model = SentenceTransformer(
+                MODEL_NAME,
+                device=device,
+                backend="onnx",
+                model_kwargs={"file_name": ONNX_FILE_NAME, "session_options": session_options}
+            )
+            logger.info(f"Model loaded successfully on {device} (onnx, {ONNX_FILE_NAME})")
+        else:
+            model = SentenceTransformer(MODEL_NAME, device=device)
+            logger.info(f"Model loaded successfully on {device}" + (" (torch)" if device == "cpu" else ""))
+
+        if os.getenv("MODEL_BACKEND") == "m2v":
+            from model2vec import StaticModel
+
+            static_model = StaticEmbeddingModel(StaticModel.from_pretrained(M2V_MODEL_NAME))
+            logger.info(f"Static model loaded successfully ({M2V_MODEL_NAME}), select with model={M2V_MODEL_ID}")
+
+        batchers[MODEL_ID] = MicroBatcher(model, MODEL_ID, MAX_BATCH_WAIT_MS, MAX_BATCH_TEXTS)
+        if static_model is not None:
+            batchers[M2V_MODEL_ID] = MicroBatcher(static_model, M2V_MODEL_ID, MAX_BATCH_WAIT_MS, MAX_BATCH_TEXTS)
+
+        for batcher in batchers.values():
+            await batcher.warmup()
+        for batcher in batchers.values():
+            batcher.start()
 
         try:
             tokenizer = tiktoken.get_encoding("cl100k_base")
@@ -91,12 +292,15 @@ async def lifespan(app: FastAPI):
     yield
     
     logger.info("Shutting down...")
+    for batcher in batchers.values():
+        await batcher.stop()
 
 app = FastAPI(
     title="all-MiniLM-L6-v2 Embedding API",
     description="OpenAI-compatible embedding API using sentence-transformers/all-MiniLM-L6-v2",
     version="1.0.5",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 @app.get("/health")
@@ -105,17 +309,26 @@ async def health_check():
 
 @app.get("/v1/models")
 async def list_models():
-    return ModelsResponse(
-        data=[
+    data = [
+        ModelInfo(
+            id=MODEL_ID,
+            created=int(time.time())
+        )
+    ]
+    if static_model is not None:
+        data.append(
             ModelInfo(
-                id="all-MiniLM-L6-v2",
-                created=int(time.time())
+                id=M2V_MODEL_ID,
+                created=int(time.time()),
+                owned_by="minishlab"
             )
-        ]
-    )
+        )
+    return ModelsResponse(data=data)
 
-@app.post("/v1/embeddings", response_model=OpenAIEmbeddingResponse)
-async def create_embeddings(request: OpenAIEmbeddingRequest):
+# Response models are documentation only (no response_model=): payloads are returned as raw
+# ORJSONResponse dicts so 384-float lists are not re-validated by Pydantic per embedding
+@app.post("/v1/embeddings", responses={200: {"model": OpenAIEmbeddingResponse}})
+async def create_embeddings(request: OpenAIEmbeddingRequest = Depends(msgspec_body(OpenAIEmbeddingRequest))):
     if model is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
@@ -125,38 +338,44 @@ async def create_embeddings(request: OpenAIEmbeddingRequest):
         else:
             texts = request.input
         
-        embeddings = model.encode(texts, convert_to_tensor=False, normalize_embeddings=True)
-        
-        if len(embeddings.shape) == 1:
-            embeddings = [embeddings.tolist()]
-        else:
-            embeddings = embeddings.tolist()
+        model_id, batcher = resolve_model(request.model)
+        embeddings = await batcher.submit(texts)
         
-        total_tokens = sum(estimate_tokens(text) for text in texts)
+        total_tokens = estimate_total_tokens(texts)
         
-        data = [
-            OpenAIEmbeddingData(
-                embedding=embedding,
-                index=i
-            )
-            for i, embedding in enumerate(embeddings)
-        ]
+        headers = None
+        if request.encoding_format in BASE64_DTYPES:
+            # Raw little-endian bytes per row: no per-float Python objects, far smaller than decimal JSON
+            dtype = BASE64_DTYPES[request.encoding_format]
+            embeddings = embeddings.astype(dtype, copy=False)
+            data = [
+                {"object": "embedding", "embedding": base64.b64encode(embedding.tobytes()).decode("ascii"), "index": i}
+                for i, embedding in enumerate(embeddings)
+            ]
+            headers = {"X-Embedding-Dtype": dtype}
+        else:
+            # Numpy rows are serialized natively by orjson (OPT_SERIALIZE_NUMPY), no .tolist() needed
+            data = [
+                {"object": "embedding", "embedding": embedding, "index": i}
+                for i, embedding in enumerate(embeddings)
+            ]
         
-        return OpenAIEmbeddingResponse(
-            data=data,
-            model="all-MiniLM-L6-v2",
-            usage=OpenAIUsage(
-                prompt_tokens=total_tokens,
-                total_tokens=total_tokens
-            )
-        )
+        return ORJSONResponse(content={
+            "object": "list",
+            "data": data,
+            "model": model_id,
+            "usage": {
+                "prompt_tokens": total_tokens,
+                "total_tokens": total_tokens
+            }
+        }, headers=headers)
         
     except Exception as e:
         logger.error(f"Error creating embeddings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/embed", response_model=OllamaEmbedResponse)
-async def ollama_embed(request: OllamaEmbedRequest):
+@app.post("/api/embed", responses={200: {"model": OllamaEmbedResponse}})
+async def ollama_embed(request: OllamaEmbedRequest = Depends(msgspec_body(OllamaEmbedRequest))):
     if model is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
@@ -166,17 +385,13 @@ async def ollama_embed(request: OllamaEmbedRequest):
         else:
             texts = request.input
         
-        embeddings = model.encode(texts, convert_to_tensor=False, normalize_embeddings=True)
-        
-        if len(embeddings.shape) == 1:
-            embeddings = [embeddings.tolist()]
-        else:
-            embeddings = embeddings.tolist()
+        model_id, batcher = resolve_model(request.model)
+        embeddings = await batcher.submit(texts)
         
-        return OllamaEmbedResponse(
-            model="all-MiniLM-L6-v2",
-            embeddings=embeddings
-        )
+        return ORJSONResponse(content={
+            "model": model_id,
+            "embeddings": embeddings
+        })
         
     except Exception as e:
         logger.error(f"Error creating embeddings: {e}")
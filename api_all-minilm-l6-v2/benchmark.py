@@ -20,9 +20,9 @@ def run_benchmark(batch_size: int):
     texts = ["This is a sample sentence for benchmarking."] * batch_size
 
     # 3. Run the encoding and time it
-    start_time = time.time()
+    start_time = time.perf_counter()
     embeddings = model.encode(texts, convert_to_tensor=False, normalize_embeddings=True)
-    end_time = time.time()
+    end_time = time.perf_counter()
 
     duration = end_time - start_time
     items_per_second = batch_size / duration
@@ -0,0 +1,81 @@
+import logging
+import threading
+from collections import deque
+
+
+class BatchSizeController:
+    """
+    Adapts the batch size at runtime from measured embedding throughput.
+
+    Replicates the manual sweep in benchmark.py against the real text length distribution:
+    - Starts at the configured batch_size
+    - After `window` batches at the current size, doubles it (up to max_batch_size) if the
+      average throughput beat the best seen at the previous size, otherwise settles on the best size
+    - On MemoryError, halves the size and stops growing
+
+    The reader thread reads `current` while the embedding thread updates it.
+    """
+
+    def __init__(self, initial_batch_size: int, max_batch_size: int, window: int = 3, min_gain: float = 0.05):
+        self._lock = threading.Lock()
+        self._current = initial_batch_size
+        self._max_batch_size = max_batch_size
+        self._window = window
+        self._min_gain = min_gain
+        self._throughputs = deque(maxlen=window)
+        self._best_throughput = 0.0
+        self._best_batch_size = initial_batch_size
+        self._settled = initial_batch_size >= max_batch_size
+
+    @property
+    def current(self) -> int:
+        """Batch size to use for the next batch."""
+        with self._lock:
+            return self._current
+
+    def record(self, batch_size: int, seconds: float) -> None:
+        """Record the embedding time of one batch and grow the batch size if throughput keeps improving."""
+        logger = logging.getLogger(__name__)
+
+        with self._lock:
+            # Only full batches at the current size are comparable (skips the final partial batch)
+            if self._settled or seconds <= 0 or batch_size != self._current:
+                return
+
+            self._throughputs.append(batch_size / seconds)
+            if len(self._throughputs) < self._window:
+                return
+
+            throughput = sum(self._throughputs) / len(self._throughputs)
+            self._throughputs.clear()
+
+            if throughput > self._best_throughput * (1 + self._min_gain):
+                self._best_throughput = throughput
+                self._best_batch_size = self._current
+
+                if self._current >= self._max_batch_size:
+                    self._settled = True
+                    logger.info(f"Batch size settled at max_batch_size {self._current} ({throughput:.2f} items/s)")
+                    return
+
+                self._current = min(self._current * 2, self._max_batch_size)
+                logger.info(f"Batch size increased to {self._current} ({throughput:.2f} items/s at previous size)")
+            else:
+                self._current = self._best_batch_size
+                self._settled = True
+                logger.info(f"Batch size settled at {self._current} ({self._best_throughput:.2f} items/s)")
+
+    def on_memory_error(self, failed_batch_size: int) -> None:
+        """Halve the batch size after an out-of-memory failure and stop growing."""
+        logger = logging.getLogger(__name__)
+
+        with self._lock:
+            # Batches prefetched at an older, larger size can still fail after a reduction: only ever shrink
+            reduced = min(self._current, max(1, failed_batch_size // 2))
+            if reduced < self._current:
+                logger.warning(f"Out of memory at batch size {failed_batch_size}, reduced to {reduced}")
+
+            self._current = reduced
+            self._max_batch_size = self._current
+            self._throughputs.clear()
+            self._settled = True
@@ -1,12 +1,40 @@
 import duckdb
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import os
 import logging
+import re
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
-from shared_utils.external.operation_logging.simple_timer import SimplerTimer
+from shared_utils.external.embed_with_duckdb_io.batch_size_controller import BatchSizeController
+from shared_utils.external.operation_logging.simple_timer import SimplerTimer, TimingStep
 import json
 
 
+# Default number of batches written per output transaction
+COMMIT_EVERY = 10
+# Default number of batches buffered between pipeline stages (reader -> embedding -> writer)
+PIPELINE_DEPTH = 2
+# Large runs with batches capped below SMALL_BATCH_SIZE pay fixed per-batch costs (callback, Arrow
+# conversion, insert) far more often than needed, so a warning is logged
+SMALL_BATCH_SIZE = 1024
+SMALL_BATCH_WARNING_ROWS = 100_000
+# Input is streamed in chunks of at most this many rows and re-sliced to the current batch size
+READ_CHUNK_ROWS = 2048
+_QUEUE_POLL_SECONDS = 0.1
+_END_OF_BATCHES = object()
+VSS_INDEX_NAME = "idx_embeddings"
+# Batches smaller than this are embedded in input order even with sort_texts_by_length
+MIN_SORT_BATCH_SIZE = 32
+# ID column type families, matched on whole type names (e.g. DECIMAL(18,3), UBIGINT; not INTERVAL)
+_NUMERIC_TYPE_RE = re.compile(r'\b(U?(TINY|SMALL|BIG|HUGE)?INT(EGER)?|VARINT|DECIMAL|NUMERIC|FLOAT|DOUBLE|REAL)\b')
+_STRING_TYPE_RE = re.compile(r'\b((VAR)?CHAR|TEXT|STRING)\b')
+
+
 class EmbeddingConfig:
     def __init__(self, config_path: str = 'embedding_config.json'):
         self.config_path = config_path
@@ -51,6 +79,72 @@ class EmbeddingConfig:
         if not isinstance(self.embedding_dimension, int) or self.embedding_dimension <= 0:
             raise ValueError("embedding_dimension must be a positive integer.")
 
+        # Fill in optional fields with defaults
+        optional_defaults = {
+            "enable_vss_index": False,
+            "backend": "onnx",
+            "embedding_dtype": "float32",
+            "torch_compile": False,
+            "max_batch_size": None,
+            "pipeline_depth": PIPELINE_DEPTH,
+            "commit_every": COMMIT_EVERY,
+            "duckdb_threads": None,
+            "duckdb_memory_limit": None,
+            "preserve_insertion_order": False,
+            "assume_sorted_ids": False,
+            "log_every_n_batches": 10,
+            "sort_texts_by_length": False
+        }
+        for field, default in optional_defaults.items():
+            if not hasattr(self, field):
+                setattr(self, field, default)
+
+        # Batch size auto-tuning may grow batch_size up to max_batch_size (default 4x batch_size)
+        if self.max_batch_size is None:
+            self.max_batch_size = self.batch_size * 4
+        if not isinstance(self.max_batch_size, int) or self.max_batch_size < self.batch_size:
+            raise ValueError("max_batch_size must be an integer >= batch_size.")
+
+        # Ensure pipeline_depth is a positive integer
+        if not isinstance(self.pipeline_depth, int) or self.pipeline_depth <= 0:
+            raise ValueError("pipeline_depth must be a positive integer.")
+
+        # Ensure commit_every is a positive integer
+        if not isinstance(self.commit_every, int) or self.commit_every <= 0:
+            raise ValueError("commit_every must be a positive integer.")
+
+        # DuckDB settings: None keeps DuckDB's own default (all cores / 80% of RAM)
+        if self.duckdb_threads is not None and (not isinstance(self.duckdb_threads, int) or self.duckdb_threads <= 0):
+            raise ValueError("duckdb_threads must be a positive integer.")
+        if self.duckdb_memory_limit is not None and not isinstance(self.duckdb_memory_limit, str):
+            raise ValueError("duckdb_memory_limit must be a string such as '8GB'.")
+        if not isinstance(self.preserve_insertion_order, bool):
+            raise ValueError("preserve_insertion_order must be a boolean.")
+
+        # Ensure assume_sorted_ids is a boolean
+        if not isinstance(self.assume_sorted_ids, bool):
+            raise ValueError("assume_sorted_ids must be a boolean.")
+
+        # Ensure log_every_n_batches is a positive integer
+        if not isinstance(self.log_every_n_batches, int) or self.log_every_n_batches <= 0:
+            raise ValueError("log_every_n_batches must be a positive integer.")
+
+        # Ensure sort_texts_by_length is a boolean
+        if not isinstance(self.sort_texts_by_length, bool):
+            raise ValueError("sort_texts_by_length must be a boolean.")
+
+        # Ensure backend is supported (only applies to CPU; CUDA always uses torch)
+        if self.backend not in ("onnx", "openvino", "torch"):
+            raise ValueError("backend must be one of: onnx, openvino, torch.")
+
+        # Ensure embedding_dtype is supported (DuckDB has no half-precision float type to store float16 in)
+        if self.embedding_dtype not in ("float32", "int8"):
+            raise ValueError("embedding_dtype must be one of: float32, int8 (float16 has no DuckDB column type).")
+
+        # HNSW indexes only support FLOAT arrays
+        if self.embedding_dtype == "int8" and self.enable_vss_index:
+            raise ValueError("enable_vss_index requires embedding_dtype float32.")
+
 class EmbeddingProcessor:
 
     def __init__(self):
@@ -59,7 +153,7 @@ class EmbeddingProcessor:
     @staticmethod
     def process_embedding(
             config: EmbeddingConfig,
-            embed_callback: Callable[[list[str]], list[list[float]]]
+            embed_callback: Callable[[list[str]], np.ndarray]
     ) -> None:
         """
         Process embeddings by reading text data from DuckDB, applying an embedding transformation,
@@ -70,14 +164,16 @@ class EmbeddingProcessor:
 
         Features:
         - Resumeability: Automatically detects last processed ID and continues from there
-        - Consistent ordering: Uses ORDER BY for all queries to ensure data integrity
-        - High-performance bulk inserts: Uses DuckDB's append() method
+        - Consistent ordering: Reads in ID order (ORDER BY, or storage order verified up front with assume_sorted_ids)
+        - High-performance bulk inserts: Inserts each batch as an Arrow table in one vectorized call
+        - Pipelining: SQL reads and bulk inserts run on background threads, overlapping the embedding step
         - Progress tracking: Reports progress and timing for each batch
         - Total rows limit: Respects config.total_rows to limit processing
+        - Batch size auto-tuning: Grows batch_size up to max_batch_size while throughput improves, halves on MemoryError
 
         Args:
             config: Configuration object with database paths, table names, columns, and batch settings
-            embed_callback: Function that takes list[str] and returns list[list[float]]
+            embed_callback: Function that takes list[str] and returns a float32 np.ndarray of shape (len(texts), embedding_dimension)
                            This encapsulates the embedding model logic
 
         Raises:
@@ -97,17 +193,21 @@ class EmbeddingProcessor:
             # Connect to databases
             input_conn = duckdb.connect(database=config.input_db_path, read_only=False) # If set to True, it prevents the output file from being the same as the input file
             output_conn = duckdb.connect(database=config.output_db_path, read_only=False)
+            EmbeddingProcessor._configure_connection(input_conn, config)
+            EmbeddingProcessor._configure_connection(output_conn, config)
 
             timer.track("initialization")
 
             try:
-                # Validate input table and columns exist
-                EmbeddingProcessor._validate_input_table(input_conn, config)
-
-                # Get the data type of the ID column
-                id_column_type = EmbeddingProcessor._get_column_type(input_conn, config.input_table, config.id_column)
+                # Validate input table and columns exist, and get the data type of the ID column
+                id_column_type = EmbeddingProcessor._validate_input_table(input_conn, config)
                 logger.info(f"ID column '{config.id_column}' type: {id_column_type}")
 
+                # Verify the storage order before any row is written: a late out-of-order ID would otherwise
+                # be skipped on resume, since resume continues after MAX(id)
+                if config.assume_sorted_ids:
+                    EmbeddingProcessor._validate_sorted_ids(input_conn, config)
+
                 # Get total count from input table
                 total_input_rows = input_conn.execute(
                     f"SELECT COUNT(*) FROM {config.input_table}"
@@ -119,10 +219,17 @@ class EmbeddingProcessor:
                 # Determine actual rows to process
                 rows_to_process = min(total_input_rows, config.total_rows)
 
+                if rows_to_process > SMALL_BATCH_WARNING_ROWS and config.max_batch_size < SMALL_BATCH_SIZE:
+                    logger.warning(
+                        f"Batch size is capped at {config.max_batch_size} for {rows_to_process} rows. "
+                        f"Per-batch overhead dominates below {SMALL_BATCH_SIZE} rows per batch, "
+                        f"consider raising batch_size / max_batch_size"
+                    )
+
                 # Check if output table exists and get last processed ID for resumeability
-                last_processed_id = EmbeddingProcessor._get_last_processed_id(output_conn, config, id_column_type)
+                resume_state = EmbeddingProcessor._get_resume_state(output_conn, config, id_column_type)
 
-                if last_processed_id is None:
+                if resume_state is None:
                     # Create output table with VSS-compatible schema
                     EmbeddingProcessor._create_output_table(output_conn, config, id_column_type)
                     logger.info(f"Created output table: {config.output_table}")
@@ -130,99 +237,90 @@ class EmbeddingProcessor:
                     last_processed_id = EmbeddingProcessor._get_initial_value_for_type(id_column_type)
                     processed_count = 0
                 else:
-                    # Get count of already processed rows
-                    processed_count = output_conn.execute(
-                        f"SELECT COUNT(*) FROM {config.output_table}"
-                    ).fetchone()[0]
+                    last_processed_id, processed_count = resume_state
+                    EmbeddingProcessor._validate_output_table(output_conn, config)
                     logger.info(f"Resuming from ID {last_processed_id} ({processed_count} rows already processed)")
 
-                timer.track("setup_and_validation")
-
-                # Main processing loop
-                batch_number = 0
-
-                while processed_count < rows_to_process:
-                    batch_number += 1
+                    # An index left by a previous run would be maintained on every insert; drop it so the
+                    # index is bulk-built once processing completes (only when rows remain and it will be rebuilt)
+                    if config.enable_vss_index and processed_count < rows_to_process:
+                        EmbeddingProcessor._drop_vss_index(output_conn, config)
 
-                    # Create a timer for this batch to track detailed timing
-                    with SimplerTimer() as batch_timer:
-                        # Calculate how many rows to fetch in this batch
-                        remaining_rows = rows_to_process - processed_count
-                        current_batch_size = min(config.batch_size, remaining_rows)
-
-                        # Fetch batch with ORDER BY for consistent ordering (critical for data integrity)
-                        batch_query = f"""
-                            SELECT {config.id_column}, {config.text_column}
-                            FROM {config.input_table}
-                            WHERE {config.id_column} > ?
-                            ORDER BY {config.id_column} ASC
-                            LIMIT ?
-                        """
-
-                        batch_data = input_conn.execute(
-                            batch_query,
-                            [last_processed_id, current_batch_size]
-                        ).fetchall()
-
-                        if not batch_data:
-                            logger.info("No more data to process")
-                            break
-
-                        batch_timer.track("sql_read")
-
-                        # Extract IDs and texts (maintain order from query)
-                        batch_ids = [row[0] for row in batch_data]
-                        batch_texts = [row[1] for row in batch_data]
-
-                        batch_timer.track("processing")
-
-                        # Generate embeddings using the provided callback
-                        embeddings = embed_callback(batch_texts)
+                timer.track("setup_and_validation")
 
-                        # Validate embedding dimension on first batch
-                        if batch_number == 1 and len(embeddings) > 0:
-                            actual_dimension = len(embeddings[0])
+                # Pipelined processing: a reader thread prefetches the next batch and a writer thread
+                # appends the previous one while this thread runs the embedding callback
+                read_queue = queue.Queue(maxsize=config.pipeline_depth)
+                write_queue = queue.Queue(maxsize=config.pipeline_depth)
+                stop_reading = threading.Event()
+                batch_size_controller = BatchSizeController(config.batch_size, config.max_batch_size)
+
+                with ThreadPoolExecutor(max_workers=2) as pool:
+                    # DuckDB connections are not safe for concurrent use, so each thread gets its own cursor
+                    # (a resumed run may already be past rows_to_process, e.g. after lowering total_rows)
+                    reader = pool.submit(
+                        EmbeddingProcessor._read_batches,
+                        input_conn.cursor(), config, last_processed_id, max(0, rows_to_process - processed_count),
+                        read_queue, stop_reading, batch_size_controller
+                    )
+                    writer = pool.submit(
+                        EmbeddingProcessor._write_batches,
+                        output_conn.cursor(), config, write_queue, processed_count, last_processed_id, rows_to_process
+                    )
+
+                    try:
+                        batch_number = 0
+
+                        while True:
+                            batch = EmbeddingProcessor._get(read_queue, reader.done)
+                            if batch is _END_OF_BATCHES:
+                                break
+
+                            batch_number += 1
+                            batch_table, batch_texts, batch_timing = batch
+                            embedding_start = time.perf_counter()
+
+                            # Generate embeddings using the provided callback, materialized as one contiguous
+                            # float32 (rows, dimension) array (no copy when the callback already returns one)
+                            embeddings = EmbeddingProcessor._embed_batch(
+                                embed_callback, batch_texts, batch_size_controller, config.sort_texts_by_length
+                            )
+
+                            # Validate embedding dimension (every batch: a shape check is free)
+                            actual_dimension = embeddings.shape[1] if embeddings.ndim == 2 else None
                             if actual_dimension != config.embedding_dimension:
                                 raise ValueError(
                                     f"Embedding dimension mismatch! "
-                                    f"Config specifies {config.embedding_dimension} but model returned {actual_dimension}. "
-                                    f"Please update embedding_dimension in embedding_config.json to {actual_dimension}."
+                                    f"Config specifies {config.embedding_dimension} but model returned shape {embeddings.shape}. "
+                                    f"Please update embedding_dimension in embedding_config.json to match the model."
                                 )
-                            logger.info(f"Embedding dimension validated: {actual_dimension}")
-
-                        batch_timer.track("embedding")
-
-                        # Prepare DataFrame for bulk insert
-                        # Note: DuckDB will automatically convert list[list[float]] to FLOAT[dimension]
-                        results_df = pd.DataFrame({
-                            config.id_column: batch_ids,
-                            config.text_column: batch_texts,
-                            'embedding': embeddings
-                        })
-
-                        # Bulk insert using high-performance append() method (Rule #8)
-                        output_conn.append(config.output_table, results_df)
-
-                        batch_timer.track("db_write_bulk")
-
-                        # Update progress tracking
-                        last_processed_id = batch_ids[-1]  # Last ID from batch (maintains DB order)
-                        processed_count += len(batch_data)
-
-                        # Report progress
-                        progress_pct = (processed_count / rows_to_process) * 100
-                        logger.info(
-                            f"Batch {batch_number}: Processed {processed_count} / {rows_to_process} "
-                            f"records ({progress_pct:.1f}%) | Last ID: {last_processed_id}"
-                        )
-
-                        # Report detailed timing breakdown
-                        timing_summary = batch_timer.get_timing_summary()
-                        timing_str = ", ".join([
-                            f"{step['step']}={step['duration_ms'] / 1000:.4f}"
-                            for step in timing_summary
-                        ])
-                        logger.info(f"  {timing_str}")
+                            if embeddings.shape[0] != len(batch_texts):
+                                raise ValueError(
+                                    f"Embedding callback returned {embeddings.shape[0]} embeddings for {len(batch_texts)} texts."
+                                )
+                            if batch_number == 1:
+                                logger.info(f"Embedding dimension validated: {actual_dimension}")
+
+                            batch_timing.append(EmbeddingProcessor._timing_step("embedding", embedding_start))
+                            batch_size_controller.record(len(batch_texts), time.perf_counter() - embedding_start)
+
+                            # Hand over to the writer (blocks when it falls pipeline_depth batches behind)
+                            if not EmbeddingProcessor._put(
+                                    write_queue, (batch_number, batch_table, embeddings, batch_timing), writer.done
+                            ):
+                                break
+                    finally:
+                        # Stop prefetching and let the writer flush whatever has already been embedded
+                        stop_reading.set()
+                        EmbeddingProcessor._put(write_queue, _END_OF_BATCHES, writer.done)
+
+                    reader.result()
+                    processed_count, last_processed_id = writer.result()
+
+                # Checkpoint the WAL once. input_conn may share the database instance (same file as the output)
+                # and CHECKPOINT fails while it is open, so it is closed first (reading is done)
+                input_conn.close()
+                output_conn.execute("CHECKPOINT")
 
                 timer.track("processing_complete")
 
@@ -252,11 +350,300 @@ class EmbeddingProcessor:
                 input_conn.close()
                 output_conn.close()
 
+    @staticmethod
+    def _read_batches(
+            conn: duckdb.DuckDBPyConnection,
+            config: EmbeddingConfig,
+            last_processed_id,
+            rows_remaining: int,
+            read_queue: queue.Queue,
+            stop_event: threading.Event,
+            batch_size_controller: BatchSizeController
+    ) -> None:
+        """
+        Reader stage: stream batches in ID order and put (Arrow table, texts, timing) on read_queue.
+
+        Each batch holds batch_size_controller.current rows (except the last).
+        Puts _END_OF_BATCHES once all rows are read. Returns early if stop_event is set.
+        """
+        logger = logging.getLogger(__name__)
+
+        # One ordered scan for the whole run, streamed as Arrow record batches:
+        # no per-batch query re-planning and no Python tuple boxing
+        # ORDER BY keeps consistent ordering (critical for data integrity). With assume_sorted_ids the
+        # input is stored in ID order already (verified by _validate_sorted_ids), so the full sort is skipped
+        order_by = "" if config.assume_sorted_ids else f"ORDER BY {config.id_column} ASC"
+        batch_query = f"""
+            SELECT {config.id_column}, {config.text_column}
+            FROM {config.input_table}
+            WHERE {config.id_column} > ?
+            {order_by}
+            LIMIT ?
+        """
+
+        reader = None
+        try:
+            read_start = time.perf_counter()
+            result = conn.execute(batch_query, [last_processed_id, rows_remaining])
+            # fetch_record_batch is deprecated in favour of to_arrow_reader on newer DuckDB releases
+            fetch_reader = getattr(result, "to_arrow_reader", None) or result.fetch_record_batch
+            reader = fetch_reader(min(config.batch_size, READ_CHUNK_ROWS))
+
+            # Chunks are buffered until they add up to the current (auto-tuned) batch size
+            pending = pa.Table.from_batches([], schema=reader.schema)
+
+            for record_batch in reader:
+                pending = pa.concat_tables([pending, pa.Table.from_batches([record_batch])])
+
+                while pending.num_rows >= batch_size_controller.current:
+                    current_batch_size = batch_size_controller.current
+                    if not EmbeddingProcessor._put_batch(
+                            read_queue, pending.slice(0, current_batch_size), read_start, stop_event
+                    ):
+                        return
+
+                    pending = pending.slice(current_batch_size)
+                    rows_remaining -= current_batch_size
+                    read_start = time.perf_counter()
+
+            if pending.num_rows > 0:
+                if not EmbeddingProcessor._put_batch(read_queue, pending, read_start, stop_event):
+                    return
+                rows_remaining -= pending.num_rows
+
+            if rows_remaining > 0:
+                logger.info("No more data to process")
+
+            EmbeddingProcessor._put(read_queue, _END_OF_BATCHES, stop_event.is_set)
+
+        finally:
+            # Release the streaming result before its cursor, even if the scan was abandoned mid-way
+            if reader is not None:
+                reader.close()
+            conn.close()
+
+    @staticmethod
+    def _check_sorted_ids(ids: pa.Array, previous_id):
+        """
+        Verify that ids are strictly increasing and follow previous_id (None for the first chunk). Returns the last ID.
+
+        Raises:
+            ValueError: If the input is not stored in ID order (assume_sorted_ids is set incorrectly)
+        """
+        if len(ids) == 0:
+            return previous_id
+
+        last_id = ids[-1].as_py()
+        follows_previous = previous_id is None or ids[0].as_py() > previous_id
+        if not follows_previous or not pc.all(pc.greater(ids.slice(1), ids.slice(0, len(ids) - 1))).as_py():
+            raise ValueError(
+                "Input table is not stored in ascending ID order, set assume_sorted_ids to false."
+            )
+        return last_id
+
+    @staticmethod
+    def _put_batch(read_queue: queue.Queue, batch_table: pa.Table, read_start: float, stop_event: threading.Event) -> bool:
+        """Put an Arrow batch and its texts on read_queue. Returns False if stopped."""
+        batch_timing = [EmbeddingProcessor._timing_step("sql_read", read_start)]
+        processing_start = time.perf_counter()
+
+        # Only the texts are converted to Python objects (the callback needs list[str]);
+        # IDs stay in the Arrow table, which is written back as-is with the embedding column appended
+        batch_texts = batch_table.column(1).to_pylist()
+
+        batch_timing.append(EmbeddingProcessor._timing_step("processing", processing_start))
+
+        return EmbeddingProcessor._put(read_queue, (batch_table, batch_texts, batch_timing), stop_event.is_set)
+
+    @staticmethod
+    def _embed_batch(
+            embed_callback: Callable[[list[str]], np.ndarray],
+            texts: list[str],
+            batch_size_controller: BatchSizeController,
+            sort_by_length: bool
+    ) -> np.ndarray:
+        """
+        Embed texts as a float32 (rows, dimension) array in input order.
+
+        With sort_by_length the callback receives the texts sorted by length, so models that pad each
+        batch to its longest text waste less compute, and the rows are restored to input order afterwards.
+        """
+        if not sort_by_length or len(texts) <= MIN_SORT_BATCH_SIZE:
+            return np.asarray(EmbeddingProcessor._embed_with_backoff(embed_callback, texts, batch_size_controller), dtype=np.float32)
+
+        order = np.argsort(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)), kind="stable")
+        sorted_embeddings = np.asarray(
+            EmbeddingProcessor._embed_with_backoff(embed_callback, [texts[i] for i in order], batch_size_controller),
+            dtype=np.float32
+        )
+
+        if sorted_embeddings.ndim != 2 or sorted_embeddings.shape[0] != len(texts):
+            return sorted_embeddings  # Shape is validated (and rejected) by the caller
+
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
+    @staticmethod
+    def _embed_with_backoff(
+            embed_callback: Callable[[list[str]], np.ndarray],
+            texts: list[str],
+            batch_size_controller: BatchSizeController
+    ):
+        """
+        Run the embedding callback. On MemoryError, halve the batch size and embed the texts in two halves.
+
+        Callbacks signal out-of-memory (e.g. CUDA OOM) by raising MemoryError.
+        """
+        try:
+            return embed_callback(texts)
+        except MemoryError:
+            if len(texts) <= 1:
+                raise
+
+            batch_size_controller.on_memory_error(len(texts))
+            half = len(texts) // 2
+            return np.concatenate([
+                np.asarray(EmbeddingProcessor._embed_with_backoff(embed_callback, texts[:half], batch_size_controller), dtype=np.float32),
+                np.asarray(EmbeddingProcessor._embed_with_backoff(embed_callback, texts[half:], batch_size_controller), dtype=np.float32)
+            ])
+
+    @staticmethod
+    def _write_batches(
+            conn: duckdb.DuckDBPyConnection,
+            config: EmbeddingConfig,
+            write_queue: queue.Queue,
+            processed_count: int,
+            last_processed_id,
+            rows_to_process: int
+    ) -> tuple:
+        """
+        Writer stage: bulk insert embedded batches from write_queue until _END_OF_BATCHES.
+
+        Batches are committed every config.commit_every batches rather than one auto-commit per insert,
+        and process_embedding checkpoints the WAL once at the end. Batches of an uncommitted transaction are lost on a
+        crash and simply reprocessed on resume.
+
+        Returns:
+            (processed_count, last_processed_id) after the last written batch
+        """
+        logger = logging.getLogger(__name__)
+
+        try:
+            uncommitted_batches = 0
+            conn.begin()
+
+            while True:
+                batch = write_queue.get()
+                if batch is _END_OF_BATCHES:
+                    conn.commit()
+                    return processed_count, last_processed_id
+
+                batch_number, batch_table, embeddings, batch_timing = batch
+                write_start = time.perf_counter()
+
+                # Append the embedding column to the (id, text) Arrow table read from the input: a contiguous
+                # float32 buffer wrapped as FixedSizeList maps directly onto FLOAT[dimension], no per-row Python lists
+
+                if config.embedding_dtype == "int8":
+                    quantized, scale = EmbeddingProcessor._quantize_int8(embeddings)
+                    batch_table = batch_table.append_column('embedding', pa.FixedSizeListArray.from_arrays(
+                        pa.array(quantized.ravel()), config.embedding_dimension
+                    ))
+                    batch_table = batch_table.append_column('scale', pa.array(scale))
+                else:
+                    batch_table = batch_table.append_column('embedding', pa.FixedSizeListArray.from_arrays(
+                        pa.array(embeddings.ravel()), config.embedding_dimension
+                    ))
+
+                # Bulk insert the Arrow table straight into the output table (the Python client's closest
+                # equivalent to the Appender): no view registration and no SQL parsing per batch
+                conn.from_arrow(batch_table).insert_into(config.output_table)
+
+                uncommitted_batches += 1
+                if uncommitted_batches >= config.commit_every:
+                    conn.commit()
+                    conn.begin()
+                    uncommitted_batches = 0
+
+                batch_timing.append(EmbeddingProcessor._timing_step("db_write_bulk", write_start))
+
+                # Update progress tracking
+                last_processed_id = batch_table.column(0)[-1].as_py()  # Last ID from batch (maintains DB order)
+                processed_count += batch_table.num_rows
+
+                # Report progress every log_every_n_batches batches (and on the last batch), so small
+                # batches don't pay for log formatting and I/O on every iteration
+                is_last_batch = processed_count >= rows_to_process
+                if (batch_number % config.log_every_n_batches == 0 or is_last_batch) and logger.isEnabledFor(logging.INFO):
+                    # One record with progress and the timing breakdown of this batch (stages overlap across batches)
+                    logger.info(
+                        "Batch %d: Processed %d / %d records (%.1f%%) | Last ID: %s | %s",
+                        batch_number, processed_count, rows_to_process, processed_count / rows_to_process * 100,
+                        last_processed_id, EmbeddingProcessor._format_batch_timing(batch_timing),
+                        extra={"batch_number": batch_number, "processed_count": processed_count, "batch_timing": batch_timing}
+                    )
+
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _quantize_int8(embeddings: np.ndarray) -> tuple:
+        """
+        Symmetric per-vector INT8 quantization: embedding ~= quantized * scale.
+
+        Returns:
+            (quantized int8 array of the same shape, float32 scale per row)
+        """
+        # Row-wise max |x| from two reductions (no full-size np.abs temporary)
+        scale = np.maximum(embeddings.max(axis=1), -embeddings.min(axis=1)) / np.float32(127.0)
+        scale[scale == 0] = 1.0  # All-zero vectors stay zero
+
+        # One scratch buffer, rounded in place, then cast
+        scaled = embeddings * (np.float32(1.0) / scale)[:, None]
+        np.rint(scaled, out=scaled)
+        return scaled.astype(np.int8), scale.astype(np.float32, copy=False)
+
+    @staticmethod
+    def _put(q: queue.Queue, item, should_stop: Callable[[], bool]) -> bool:
+        """Put with backpressure. Gives up and returns False once should_stop() is true."""
+        while True:
+            try:
+                q.put(item, timeout=_QUEUE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                if should_stop():
+                    return False
+
+    @staticmethod
+    def _get(q: queue.Queue, should_stop: Callable[[], bool]):
+        """Blocking get. Returns _END_OF_BATCHES if the queue is empty and should_stop() is true."""
+        while True:
+            try:
+                return q.get(timeout=_QUEUE_POLL_SECONDS)
+            except queue.Empty:
+                if should_stop():
+                    return _END_OF_BATCHES
+
+    @staticmethod
+    def _format_batch_timing(batch_timing: list[TimingStep]) -> str:
+        """Format a batch's timing steps as one line, e.g. "sql_read=0.0120, embedding=0.4310" (seconds)."""
+        return ", ".join(f"{step['step']}={step['duration_ms'] / 1000:.4f}" for step in batch_timing)
+
+    @staticmethod
+    def _timing_step(step: str, start: float) -> TimingStep:
+        """Build a TimingStep for a stage that started at `start` (time.perf_counter())."""
+        return {"step": step, "duration_ms": round((time.perf_counter() - start) * 1000)}
+
     @staticmethod
     def create_vss_index(config: EmbeddingConfig) -> None:
         """
         Create VSS (Vector Similarity Search) index on the embedding column.
 
+        Built once after all inserts: a bulk HNSW build is far cheaper than maintaining the
+        index on every append. An existing index is kept: resumed runs that insert rows drop it
+        before inserting, so it only still exists when no rows were added.
+
         Args:
             config: Configuration object with output database path and table name
 
@@ -272,16 +659,23 @@ class EmbeddingProcessor:
             logger.info("=" * 80)
 
             output_conn = duckdb.connect(database=config.output_db_path, read_only=False)
+            EmbeddingProcessor._configure_connection(output_conn, config)
 
             try:
                 output_conn.execute("INSTALL vss;")
                 output_conn.execute("LOAD vss;")
                 output_conn.execute("SET hnsw_enable_experimental_persistence = true;")
-                output_conn.execute(f"CREATE INDEX idx_embeddings ON {config.output_table} USING HNSW (embedding);")
 
-                timer.track("index_created")
+                if EmbeddingProcessor._vss_index_exists(output_conn, config):
+                    logger.info(f"VSS index {VSS_INDEX_NAME} is up to date (no rows added), skipping rebuild")
+                else:
+                    # Embeddings are normalized, so cosine is the matching metric
+                    output_conn.execute(
+                        f"CREATE INDEX {VSS_INDEX_NAME} ON {config.output_table} USING HNSW (embedding) WITH (metric = 'cosine');"
+                    )
+                    logger.info(f"VSS index created on {config.output_table}.embedding")
 
-                logger.info(f"VSS index created on {config.output_table}.embedding")
+                timer.track("index_created")
 
                 # Get timing summary
                 timing_summary = timer.get_timing_summary()
@@ -292,10 +686,30 @@ class EmbeddingProcessor:
             finally:
                 output_conn.close()
 
+    @staticmethod
+    def fetch_sample_texts(config: EmbeddingConfig, limit: int) -> list[str]:
+        """Read the first `limit` non-null texts (by ID) from the input table, e.g. for model calibration/validation."""
+        conn = duckdb.connect(database=config.input_db_path, read_only=True)
+        try:
+            rows = conn.execute(
+                f"""
+                SELECT {config.text_column}
+                FROM {config.input_table}
+                WHERE {config.text_column} IS NOT NULL
+                ORDER BY {config.id_column} ASC
+                LIMIT ?
+                """,
+                [limit]
+            ).fetchall()
+        finally:
+            conn.close()
+
+        return [row[0] for row in rows]
+
     @staticmethod
     def process_duckdb(
             config: EmbeddingConfig,
-            embed_callback: Callable[[list[str]], list[list[float]]]
+            embed_callback: Callable[[list[str]], np.ndarray]
     ) -> None:
         """
         Orchestrate the complete processing pipeline: embedding generation and optional VSS indexing.
@@ -306,7 +720,7 @@ class EmbeddingProcessor:
 
         Args:
             config: Configuration object with database paths, table names, columns, and batch settings
-            embed_callback: Function that takes list[str] and returns list[list[float]]
+            embed_callback: Function that takes list[str] and returns a float32 np.ndarray of shape (len(texts), embedding_dimension)
 
         Raises:
             FileNotFoundError: If input database file doesn't exist
@@ -344,39 +758,99 @@ class EmbeddingProcessor:
 
 
     @staticmethod
-    def _validate_input_table(conn: duckdb.DuckDBPyConnection, config: EmbeddingConfig) -> None:
-        """Validate that input table and required columns exist."""
+    def _validate_input_table(conn: duckdb.DuckDBPyConnection, config: EmbeddingConfig) -> str:
+        """
+        Validate that input table and required columns exist.
 
-        # Check if table exists
-        tables = conn.execute(
-            "SELECT table_name FROM information_schema.tables WHERE table_name = ?",
-            [config.input_table]
-        ).fetchall()
+        Returns:
+            Data type of the ID column (e.g., 'INTEGER', 'VARCHAR', 'BIGINT'), from the same catalog lookup
+        """
 
-        if not tables:
-            raise ValueError(f"Input table '{config.input_table}' does not exist")
+        # Single catalog lookup (no information_schema scan); a missing table raises CatalogException
+        try:
+            columns = conn.execute(f"PRAGMA table_info('{config.input_table}')").fetchall()
+        except duckdb.CatalogException:
+            columns = []
 
-        # Check if required columns exist
-        columns = conn.execute(
-            f"SELECT column_name FROM information_schema.columns WHERE table_name = ?",
-            [config.input_table]
-        ).fetchall()
+        if not columns:
+            raise ValueError(f"Input table '{config.input_table}' does not exist")
 
-        column_names = [col[0] for col in columns]
+        # table_info rows: (cid, name, type, notnull, dflt_value, pk)
+        column_types = {col[1]: col[2] for col in columns}
 
-        if config.id_column not in column_names:
+        if config.id_column not in column_types:
             raise ValueError(f"ID column '{config.id_column}' not found in table '{config.input_table}'")
 
-        if config.text_column not in column_names:
+        if config.text_column not in column_types:
             raise ValueError(f"Text column '{config.text_column}' not found in table '{config.input_table}'")
 
+        return column_types[config.id_column]
+
 
     @staticmethod
-    def _get_last_processed_id(conn: duckdb.DuckDBPyConnection, config: EmbeddingConfig, id_column_type: str):
+    def _validate_sorted_ids(conn: duckdb.DuckDBPyConnection, config: EmbeddingConfig) -> None:
+        """
+        Verify that the whole ID column is stored in ascending order (one streamed scan of the column, no sort).
+
+        Raises:
+            ValueError: If the input is not stored in ID order (assume_sorted_ids is set incorrectly)
         """
-        Get the last processed ID from output table for resumeability.
-        Returns None if table doesn't exist, or the max ID value.
-        If table exists but is empty, returns appropriate initial value for the type.
+        reader = None
+        try:
+            result = conn.execute(f"SELECT {config.id_column} FROM {config.input_table}")
+            fetch_reader = getattr(result, "to_arrow_reader", None) or result.fetch_record_batch
+            reader = fetch_reader(READ_CHUNK_ROWS)
+
+            previous_id = None
+            for record_batch in reader:
+                previous_id = EmbeddingProcessor._check_sorted_ids(record_batch.column(0), previous_id)
+        finally:
+            if reader is not None:
+                reader.close()
+
+
+    @staticmethod
+    def _configure_connection(conn: duckdb.DuckDBPyConnection, config: EmbeddingConfig) -> None:
+        """
+        Apply DuckDB settings from config. Settings are per database instance and shared by its cursors.
+
+        Rows are ordered explicitly (ORDER BY on read, MAX(id) on resume), so insertion order does not need
+        to be preserved by default, which lets DuckDB parallelize bulk inserts with less buffering.
+        With assume_sorted_ids the input is read in storage order, so insertion order is always preserved.
+        """
+        if config.duckdb_threads is not None:
+            conn.execute(f"SET threads = {config.duckdb_threads};")
+        if config.duckdb_memory_limit is not None:
+            conn.execute(f"SET memory_limit = '{config.duckdb_memory_limit}';")
+        preserve_insertion_order = config.preserve_insertion_order or config.assume_sorted_ids
+        conn.execute(f"SET preserve_insertion_order = {str(preserve_insertion_order).lower()};")
+
+    @staticmethod
+    def _vss_index_exists(conn: duckdb.DuckDBPyConnection, config: EmbeddingConfig) -> bool:
+        """Check whether the VSS index exists on the output table."""
+        return conn.execute(
+            "SELECT 1 FROM duckdb_indexes() WHERE index_name = ? AND table_name = ?",
+            [VSS_INDEX_NAME, config.output_table]
+        ).fetchone() is not None
+
+    @staticmethod
+    def _drop_vss_index(conn: duckdb.DuckDBPyConnection, config: EmbeddingConfig) -> None:
+        """Drop the VSS index on the output table if a previous run created one."""
+        logger = logging.getLogger(__name__)
+
+        if EmbeddingProcessor._vss_index_exists(conn, config):
+            conn.execute("INSTALL vss;")
+            conn.execute("LOAD vss;")
+            conn.execute(f"DROP INDEX {VSS_INDEX_NAME};")
+            logger.info(f"Dropped existing VSS index {VSS_INDEX_NAME}, it will be rebuilt after processing")
+
+
+    @staticmethod
+    def _get_resume_state(conn: duckdb.DuckDBPyConnection, config: EmbeddingConfig, id_column_type: str):
+        """
+        Get the last processed ID and processed row count from output table for resumeability.
+        Returns None if table doesn't exist, otherwise (max ID value, row count).
+        If table exists but is empty, the ID is the appropriate initial value for the type.
         """
 
         # Check if output table exists
@@ -388,12 +862,14 @@ class EmbeddingProcessor:
         if not tables:
             return None
 
-        # Get max ID (using ORDER BY id_column for consistency)
-        result = conn.execute(
-            f"SELECT MAX({config.id_column}) FROM {config.output_table}"
+        # Max ID and row count in a single scan of the output table
+        max_id, row_count = conn.execute(
+            f"SELECT MAX({config.id_column}), COUNT(*) FROM {config.output_table}"
         ).fetchone()
 
-        return result[0] if result[0] is not None else EmbeddingProcessor._get_initial_value_for_type(id_column_type)
+        if max_id is None:
+            max_id = EmbeddingProcessor._get_initial_value_for_type(id_column_type)
+        return max_id, row_count
 
 
     @staticmethod
@@ -404,45 +880,60 @@ class EmbeddingProcessor:
         Schema: (id_column, text_column, embedding FLOAT[dimension])
         The FLOAT[dimension] type is compatible with DuckDB's VSS extension for cosine similarity search.
         The id_column type matches the source table's type.
-        """
 
-        create_table_sql = f"""
-            CREATE TABLE {config.output_table} (
-                {config.id_column} {id_column_type},
-                {config.text_column} TEXT,
-                embedding FLOAT[{config.embedding_dimension}]
-            )
+        With embedding_dtype "int8" the schema is (id_column, text_column, embedding TINYINT[dimension], scale FLOAT),
+        4x smaller than FLOAT, plus a {output_table}_dequantized view that reconstructs FLOAT[dimension].
         """
 
+        if config.embedding_dtype == "int8":
+            create_table_sql = f"""
+                CREATE TABLE {config.output_table} (
+                    {config.id_column} {id_column_type},
+                    {config.text_column} TEXT,
+                    embedding TINYINT[{config.embedding_dimension}],
+                    scale FLOAT
+                )
+            """
+        else:
+            create_table_sql = f"""
+                CREATE TABLE {config.output_table} (
+                    {config.id_column} {id_column_type},
+                    {config.text_column} TEXT,
+                    embedding FLOAT[{config.embedding_dimension}]
+                )
+            """
+
         conn.execute(create_table_sql)
 
+        if config.embedding_dtype == "int8":
+            conn.execute(f"""
+                CREATE VIEW {config.output_table}_dequantized AS
+                SELECT
+                    {config.id_column},
+                    {config.text_column},
+                    CAST([x * scale FOR x IN embedding] AS FLOAT[{config.embedding_dimension}]) AS embedding
+                FROM {config.output_table}
+            """)
+
 
     @staticmethod
-    def _get_column_type(conn: duckdb.DuckDBPyConnection, table_name: str, column_name: str) -> str:
+    def _validate_output_table(conn: duckdb.DuckDBPyConnection, config: EmbeddingConfig) -> None:
         """
-        Get the data type of a column from the database schema.
-
-        Args:
-            conn: DuckDB connection
-            table_name: Name of the table
-            column_name: Name of the column
+        Validate that an existing output table matches embedding_dtype and embedding_dimension before resuming.
 
-        Returns:
-            Data type as a string (e.g., 'INTEGER', 'VARCHAR', 'BIGINT')
+        Without this, resuming with a different embedding_dtype would cast float32 embeddings into an existing
+        TINYINT column (silently rounding them to -1/0/1) or fail on the column count.
         """
-        result = conn.execute(
-            """
-            SELECT data_type
-            FROM information_schema.columns
-            WHERE table_name = ? AND column_name = ?
-            """,
-            [table_name, column_name]
-        ).fetchone()
-
-        if result is None:
-            raise ValueError(f"Column '{column_name}' not found in table '{table_name}'")
-
-        return result[0]
+        column_types = {col[1]: col[2] for col in conn.execute(f"PRAGMA table_info('{config.output_table}')").fetchall()}
+        element_type = "TINYINT" if config.embedding_dtype == "int8" else "FLOAT"
+        expected_type = f"{element_type}[{config.embedding_dimension}]"
+
+        if column_types.get("embedding") != expected_type:
+            raise ValueError(
+                f"Output table '{config.output_table}' has embedding type {column_types.get('embedding')}, "
+                f"but embedding_dtype {config.embedding_dtype} requires {expected_type}. "
+                f"Use a new output_table or the original embedding_dtype."
+            )
 
     @staticmethod
     def _get_initial_value_for_type(data_type: str):
@@ -462,16 +953,11 @@ class EmbeddingProcessor:
         data_type_upper = data_type.upper()
 
         # Numeric types
-        if any(numeric_type in data_type_upper for numeric_type in [
-            'INT', 'INTEGER', 'BIGINT', 'SMALLINT', 'TINYINT',
-            'DECIMAL', 'NUMERIC', 'FLOAT', 'DOUBLE', 'REAL'
-        ]):
+        if _NUMERIC_TYPE_RE.search(data_type_upper):
             return 0
 
         # String types
-        if any(string_type in data_type_upper for string_type in [
-            'CHAR', 'VARCHAR', 'TEXT', 'STRING'
-        ]):
+        if _STRING_TYPE_RE.search(data_type_upper):
             return ''
 
         # Default to empty string for unknown types (safe fallback)
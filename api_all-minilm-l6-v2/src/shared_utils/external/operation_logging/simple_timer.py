@@ -126,14 +126,13 @@ class SimplerTimer:
         Returns:
             String like "Timer: [step1: 123ms], [step2: 456ms], TOTAL: 579ms"
         """
-        total_duration = self.duration
-        timing_parts = [f"[{name}: {duration * 1000:.0f}ms]" for name, duration in self._tracks]
-        total_str = f"TOTAL: {total_duration * 1000:.0f}ms"
+        total_ms = self.duration * 1000
 
-        if not timing_parts:
-            return f"Timer: {total_str}"
-        else:
-            return "Timer: " + ", ".join(timing_parts) + f", {total_str}"
+        if not self._tracks:
+            return f"Timer: TOTAL: {total_ms:.0f}ms"
+
+        timing_parts = ", ".join(f"[{name}: {duration * 1000:.0f}ms]" for name, duration in self._tracks)
+        return f"Timer: {timing_parts}, TOTAL: {total_ms:.0f}ms"
 
     def construct_tabular_message(self) -> str:
         """Construct multi-line tabular timer message with percentages and bottleneck identification.